@@ -1,19 +1,28 @@
 # backend/ai_model.py
 
 import os
+import functools
+import hashlib
 import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import numpy as np
+from cachetools import LRUCache, TTLCache
+import openpyxl
 import pandas as pd
 
 # Removed direct import of db, Company, BalanceSheet from models at top level
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_community.vectorstores import Chroma
+import chromadb
+from chromadb.errors import NotFoundError
 from langchain_core.documents import Document
 from langchain_core.prompts import PromptTemplate
 
-from langchain.memory import ConversationBufferMemory
+from langchain.memory import ConversationBufferWindowMemory
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain.chains.retrieval import create_retrieval_chain
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from dotenv import load_dotenv
 import models
@@ -25,29 +34,110 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "..", ".env"))
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+
 # Define the path for ChromaDB persistent storage
 CHROMA_DB_PATH = "./chroma_db"
 
+# HNSW index settings for every per-company collection
+COLLECTION_METADATA = {
+    "hnsw:space": "cosine",
+    "hnsw:M": 32,
+    "hnsw:construction_ef": 200,
+    "hnsw:search_ef": 64,
+}
+
+# Row labels of the metrics extracted from uploaded financial statements
+FINANCIAL_METRICS = [
+    "Revenue",
+    "Net Income",
+    "Total Assets",
+    "Total Liabilities",
+]
+
+# Number of texts sent to the embeddings API per request, and how many of
+# those requests may be in flight at once (keeps us under Gemini rate limits).
+# Both can be overridden from the environment.
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 100))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", 4))
+
+# Number of per-company vectorstore handles kept open
+VECTORSTORE_CACHE_SIZE = 256
+
+# Chat memory: number of conversations kept in memory and turns replayed per prompt.
+# Only the last MEMORY_WINDOW_TURNS exchanges are sent to Gemini, so prompt size
+# stays constant instead of growing with every turn of a conversation.
+MEMORY_STORE_SIZE = 1024
+# Conversations idle for this many seconds are dropped from the store
+MEMORY_TTL_SECONDS = 3600
+MEMORY_WINDOW_TURNS = 6
+
+# Query cache: capacity and cosine similarity above which a cached query is reused
+QUERY_CACHE_SIZE = 512
+QUERY_CACHE_SIMILARITY = 0.97
+
+SYSTEM_PROMPT = (
+    "You are a financial analyst AI assistant specializing in balance sheet analysis. "
+    "You have access to structured financial data for company ID {company_id}. "
+    "Use the provided context to answer questions about financial metrics, trends, and insights. "
+    "Be precise, analytical, and provide specific numbers from the data when available. "
+    "If you cannot find relevant information in the context, clearly state that. "
+    "Keep your responses concise but informative. "
+    "Only use the information provided in the context.\n\n"
+    "Context:\n{context}"
+)
+
+NO_DATA_RESPONSE = (
+    "I cannot answer this question based on the available financial data."
+)
+
+CHAT_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        ("system", SYSTEM_PROMPT),
+        MessagesPlaceholder("chat_history"),
+        ("human", "{input}"),
+    ]
+)
+
 # Global instances (initialized once)
 _llm = None
 _embeddings = None
-_vectorstore = None
-_memory_store = {}
-
-
+_chroma_client = None
+# company_id -> Chroma vectorstore over that company's collection
+_company_vectorstores = LRUCache(maxsize=VECTORSTORE_CACHE_SIZE)
+_company_vectorstores_lock = threading.Lock()
+# (user, company) conversation -> window memory, evicted least recently used
+# first and once idle for MEMORY_TTL_SECONDS
+_memory_store = TTLCache(maxsize=MEMORY_STORE_SIZE, ttl=MEMORY_TTL_SECONDS)
+_memory_store_lock = threading.Lock()
+# sha256(company_id + normalized query) -> slot in the query cache buffers below.
+# Unit query embeddings live in one preallocated (QUERY_CACHE_SIZE, dim) matrix
+# so a fuzzy lookup is a single matrix-vector product with no per-call stacking.
+_query_cache = OrderedDict()
+_query_vectors = None
+_query_slot_company = np.full(QUERY_CACHE_SIZE, None, dtype=object)
+_query_slot_documents = [None] * QUERY_CACHE_SIZE
+_query_free_slots = list(range(QUERY_CACHE_SIZE))
+# Guards the query cache state above and the generations below
+_query_cache_lock = threading.Lock()
+# company_id -> number of invalidations; a search that started under an older
+# generation must not write its (stale) results back into the cache
+_query_cache_generation = {}
+# Prompt + LLM chain, built once by _get_document_chain
+_document_chain = None
+
+
+@functools.lru_cache(maxsize=1)
 def initialize_ai_components():
     """
-    Initializes Google Gemini LLM and embeddings, and sets up the ChromaDB vectorstore.
-    This function should be called once at application startup.
+    Initializes Google Gemini LLM and embeddings, and sets up the ChromaDB client.
+    This function should be called once at application startup; later calls
+    return the components created by the first successful call.
     """
-    global _llm, _embeddings, _vectorstore
+    global _llm, _embeddings, _chroma_client
 
-    load_dotenv(
-        dotenv_path=os.path.join(os.path.dirname(__file__), "..", ".env")
-    )
-
-    gemini_api_key = os.getenv("GEMINI_API_KEY")
-    if not gemini_api_key:
+    if not GEMINI_API_KEY:
         logger.error(
             "GEMINI_API_KEY environment variable not set. AI components cannot be initialized."
         )
@@ -59,7 +149,7 @@ def initialize_ai_components():
         try:
             _llm = ChatGoogleGenerativeAI(
                 model="gemini-1.5-pro",
-                google_api_key=gemini_api_key,
+                google_api_key=GEMINI_API_KEY,
                 temperature=0.2,
             )
             logger.info(
@@ -73,7 +163,7 @@ def initialize_ai_components():
     if _embeddings is None:
         try:
             _embeddings = GoogleGenerativeAIEmbeddings(
-                model="embedding-001", google_api_key=gemini_api_key
+                model="embedding-001", google_api_key=GEMINI_API_KEY
             )
             logger.info(
                 "Google Gemini Embeddings (embedding-001) initialized successfully."
@@ -83,32 +173,99 @@ def initialize_ai_components():
             _embeddings = None
             raise
 
-    if _llm and _embeddings and _vectorstore is None:
+    if _llm and _embeddings and _chroma_client is None:
         try:
             os.makedirs(CHROMA_DB_PATH, exist_ok=True)
-            _vectorstore = Chroma(
-                persist_directory=CHROMA_DB_PATH,
-                embedding_function=_embeddings,
-            )
+            _chroma_client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
             logger.info(
-                f"ChromaDB vectorstore initialized/loaded from {CHROMA_DB_PATH}."
+                f"ChromaDB client initialized/loaded from {CHROMA_DB_PATH}."
             )
         except Exception as e:
-            logger.error(f"Failed to initialize ChromaDB vectorstore: {e}")
-            _vectorstore = None
+            logger.error(f"Failed to initialize ChromaDB client: {e}")
+            _chroma_client = None
             raise
 
-    return _llm, _embeddings, _vectorstore
+    return _llm, _embeddings, _chroma_client
+
+
+def _collection_name(company_id):
+    return f"company_{company_id}"
+
+
+def _get_company_vectorstore(company_id, create=False):
+    """
+    Returns the vectorstore over a single company's collection. With
+    create=True (ingestion only) the collection is created with
+    COLLECTION_METADATA if missing; otherwise a company without a collection
+    returns None, so reads never create collections on disk.
+    """
+    with _company_vectorstores_lock:
+        vectorstore = _company_vectorstores.get(str(company_id))
+    if vectorstore is not None:
+        return vectorstore
+
+    if not create:
+        try:
+            _chroma_client.get_collection(_collection_name(company_id))
+        except NotFoundError:
+            return None
+
+    vectorstore = Chroma(
+        client=_chroma_client,
+        collection_name=_collection_name(company_id),
+        embedding_function=_embeddings,
+        collection_metadata=COLLECTION_METADATA,
+    )
+    with _company_vectorstores_lock:
+        _company_vectorstores[str(company_id)] = vectorstore
+    return vectorstore
+
+
+def _read_csv(source):
+    """
+    Parses a CSV with pyarrow's multithreaded reader, falling back to the
+    default C parser when pyarrow is not installed.
+    """
+    try:
+        return pd.read_csv(source, engine="pyarrow")
+    except ImportError:
+        return pd.read_csv(source)
+
+
+def _read_xlsx(source):
+    """
+    Streams the first worksheet of an Excel file into a DataFrame using
+    openpyxl's read-only mode, with the first row as the header.
+    Like pd.read_excel, skips rows that are entirely empty (read-only mode
+    returns formatted-but-empty rows as all None) and unnamed empty columns.
+    """
+    workbook = openpyxl.load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return pd.DataFrame()
+        keep = [index for index, name in enumerate(header) if name is not None]
+        data = [
+            [row[index] if index < len(row) else None for index in keep]
+            for row in rows
+            if any(value is not None for value in row)
+        ]
+        return pd.DataFrame(data, columns=[header[index] for index in keep])
+    finally:
+        workbook.close()
 
 
 def process_structured_financial_data(
-    filepath, company_id, embeddings, db_session
+    source, file_extension, company_id, embeddings, db_session
 ):
     """
     Loads financial data from a structured CSV/Excel file, extracts key metrics for ALL years found,
     stores them in the database, and generates text chunks for ChromaDB.
+    source is a path or a seekable binary file object, such as an upload's
+    stream; file_extension (".csv" or ".xlsx") picks the parser.
     """
-    global _vectorstore
+    global _chroma_client
 
     if embeddings is None:
         logger.error(
@@ -116,29 +273,29 @@ def process_structured_financial_data(
         )
         return None
 
-    if _vectorstore is None:
+    if _chroma_client is None:
         try:
-            _vectorstore = Chroma(
-                persist_directory=CHROMA_DB_PATH, embedding_function=embeddings
-            )
+            _chroma_client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
             logger.info(
-                f"Re-initialized ChromaDB vectorstore from {CHROMA_DB_PATH}."
+                f"Re-initialized ChromaDB client from {CHROMA_DB_PATH}."
             )
         except Exception as e:
-            logger.error(f"Failed to re-initialize ChromaDB vectorstore: {e}")
+            logger.error(f"Failed to re-initialize ChromaDB client: {e}")
             return None
 
     try:
-        file_extension = os.path.splitext(filepath)[1].lower()
         if file_extension == ".csv":
-            df = pd.read_csv(filepath)
+            df = _read_csv(source)
         elif file_extension == ".xlsx":
-            df = pd.read_excel(filepath)
+            df = _read_xlsx(source)
         else:
             logger.error(f"Unsupported file type: {file_extension}")
             return None
 
         df.set_index("Metric", inplace=True)
+        # Blank and repeated labels (empty rows, several "Notes" rows) would
+        # make the reindex below fail; the first row of each label wins
+        df = df[df.index.notna() & ~df.index.duplicated()]
 
         # Identify year columns dynamically
         # Filter out non-numeric/non-year columns (like 'Metric' if it somehow became a column)
@@ -148,7 +305,9 @@ def process_structured_financial_data(
             if str(col).isdigit() and len(str(col)) == 4
         ]
         if not year_columns:
-            logger.warning(f"No valid year columns found in file {filepath}.")
+            logger.warning(
+                f"No valid year columns found in {file_extension} file for company {company_id}."
+            )
             return {
                 "status": "no_years_found",
                 "message": "No valid year columns (e.g., 2022) found in the uploaded file.",
@@ -164,108 +323,40 @@ def process_structured_financial_data(
             company_obj.name if company_obj else f"Company {company_id}"
         )
 
+        years = [int(year_col) for year_col in year_columns]
+
         all_processed_data = {}
+        balance_sheet_rows = []
         documents_for_chroma = []
 
-        for year_col in year_columns:
-            year = int(year_col)  # Ensure year is an integer
-
-            # First, delete existing vectors for this company and year to prevent duplicates/stale data
-            # You need to ensure delete_vectors_for_balance_sheet accepts int for company_id and year
-            delete_vectors_for_balance_sheet(company_id)
+        # Pull every metric for every year in one pass; non-numeric cells become NaN
+        metric_values = (
+            df.reindex(index=FINANCIAL_METRICS)[year_columns]
+            .apply(pd.to_numeric, errors="coerce")
+            .astype(float)
+            .astype(object)
+            .where(lambda frame: frame.notna(), None)
+        )
 
-            # Then, delete existing SQL DB entry for this company and year
-            existing_bs_entry = (
-                db_session.query(BalanceSheet)
-                .filter_by(company_id=company_id, year=year)
-                .first()
-            )
-            if existing_bs_entry:
-                db_session.delete(existing_bs_entry)
-                db_session.commit()
-                logger.info(
-                    f"Deleted existing balance sheet entry for Company ID: {company_id}, Year: {year}"
-                )
-
-            # Data Extraction for the current year_col
-            extracted_revenue = (
-                df.loc["Revenue", year_col]
-                if year_col in df.columns and "Revenue" in df.index
-                else None
-            )
-            extracted_net_income = (
-                df.loc["Net Income", year_col]
-                if year_col in df.columns and "Net Income" in df.index
-                else None
-            )
-            extracted_assets = (
-                df.loc["Total Assets", year_col]
-                if year_col in df.columns and "Total Assets" in df.index
-                else None
-            )
-            extracted_liabilities = (
-                df.loc["Total Liabilities", year_col]
-                if year_col in df.columns and "Total Liabilities" in df.index
-                else None
-            )
+        for year_col, year in zip(year_columns, years):
+            financial_metrics = metric_values[year_col].to_dict()
 
-            # Convert to float, handle non-numeric data
-            try:
-                extracted_revenue = (
-                    float(extracted_revenue)
-                    if extracted_revenue is not None
-                    else None
-                )
-            except ValueError:
-                extracted_revenue = None
-            try:
-                extracted_net_income = (
-                    float(extracted_net_income)
-                    if extracted_net_income is not None
-                    else None
-                )
-            except ValueError:
-                extracted_net_income = None
-            try:
-                extracted_assets = (
-                    float(extracted_assets)
-                    if extracted_assets is not None
-                    else None
-                )
-            except ValueError:
-                extracted_assets = None
-            try:
-                extracted_liabilities = (
-                    float(extracted_liabilities)
-                    if extracted_liabilities is not None
-                    else None
-                )
-            except ValueError:
-                extracted_liabilities = None
-
-            # Store in SQL Database (BalanceSheet model)
-            new_bs_entry = BalanceSheet(
-                company_id=company_id,
-                year=year,
-                revenue=extracted_revenue,
-                net_income=extracted_net_income,
-                assets=extracted_assets,
-                liabilities=extracted_liabilities,
-            )
-            db_session.add(new_bs_entry)
-            db_session.commit()  # Commit after each year's entry
-            logger.info(
-                f"Stored structured data for company {company_id}, year {year} in SQL DB."
+            processed = {
+                "revenue": financial_metrics["Revenue"],
+                "net_income": financial_metrics["Net Income"],
+                "assets": financial_metrics["Total Assets"],
+                "liabilities": financial_metrics["Total Liabilities"],
+            }
+            balance_sheet_rows.append(
+                {"company_id": company_id, "year": year, **processed}
             )
 
-            # Prepare for ChromaDB (RAG)
-            financial_metrics = {
-                "Revenue": extracted_revenue,
-                "Net Income": extracted_net_income,
-                "Total Assets": extracted_assets,
-                "Total Liabilities": extracted_liabilities,
+            # Metadata shared by every metric of this year
+            base_metadata = {
+                "company_id": company_id,
+                "year": year,
+                "source": f"FinancialData_{company_id}_{year}{file_extension}",
             }
-
             for metric_name, metric_value in financial_metrics.items():
                 if metric_value is not None:
                     text_content = f"For {company_name}, the {metric_name.lower()} in {year} was {metric_value}."
@@ -273,42 +364,49 @@ def process_structured_financial_data(
                         Document(
                             page_content=text_content,
                             metadata={
-                                "company_id": company_id,
-                                "year": year,
+                                **base_metadata,
                                 "metric": metric_name,
                                 "value": metric_value,
-                                "source": (
-                                    f"FinancialData_{company_id}_{year}.csv"
-                                    if file_extension == ".csv"
-                                    else f"FinancialData_{company_id}_{year}.xlsx"
-                                ),
                             },
                         )
                     )
 
-            all_processed_data[year] = {
-                "revenue": extracted_revenue,
-                "net_income": extracted_net_income,
-                "assets": extracted_assets,
-                "liabilities": extracted_liabilities,
-            }
+            all_processed_data[year] = processed
+
+        # Only now that extraction succeeded, replace the existing vectors and
+        # SQL rows for the uploaded years
+        delete_vectors_for_balance_sheet(company_id, years)
+        db_session.query(BalanceSheet).filter(
+            BalanceSheet.company_id == company_id,
+            BalanceSheet.year.in_(years),
+        ).delete(synchronize_session=False)
+
+        # Store in SQL Database (BalanceSheet model) in a single transaction
+        db_session.bulk_insert_mappings(BalanceSheet, balance_sheet_rows)
+        db_session.commit()
+        logger.info(
+            f"Stored structured data for company {company_id}, years {years} in SQL DB."
+        )
 
         if documents_for_chroma:
-            _vectorstore.add_documents(documents_for_chroma)
-            # _vectorstore.persist()
+            _add_documents_batched(
+                company_id, documents_for_chroma, embeddings
+            )
+            _invalidate_query_cache(company_id)
             logger.info(
                 f"Successfully loaded {len(documents_for_chroma)} structured data chunks into vector store for company {company_id} across multiple years."
             )
         else:
             logger.warning(
-                f"No valid data points found in file {filepath} for company {company_id} to add to vector store. This might be due to missing expected metrics or year columns."
+                f"No valid data points found in {file_extension} file for company {company_id} to add to vector store. This might be due to missing expected metrics or year columns."
             )
 
         return {"status": "success", "processed_years": all_processed_data}
 
     except Exception as e:
+        db_session.rollback()
         logger.error(
-            f"Error processing structured file {filepath} for company {company_id}: {e}"
+            f"Error processing structured {file_extension} file for company {company_id}: {e}"
         )
         import traceback
 
@@ -316,27 +414,243 @@ def process_structured_financial_data(
         return {"status": "error", "message": str(e)}
 
 
-def delete_vectors_for_balance_sheet(company_id):
-    global _vectorstore
-    if _vectorstore is None:
+def _embed_and_upsert(collection, company_id, batch, embeddings):
+    """
+    Embeds one batch with a single embeddings call and upserts the vectors.
+    """
+    texts = [doc.page_content for doc in batch]
+    vectors = embeddings.embed_documents(texts)
+    collection.upsert(
+        ids=[
+            f"{company_id}:{doc.metadata['year']}:{doc.metadata['metric']}"
+            for doc in batch
+        ],
+        embeddings=vectors,
+        metadatas=[doc.metadata for doc in batch],
+        documents=texts,
+    )
+
+
+def _add_documents_batched(company_id, documents, embeddings):
+    """
+    Embeds documents in batches of EMBED_BATCH_SIZE and upserts the precomputed
+    vectors into the company's Chroma collection. IDs are derived from
+    company, year and metric, so re-ingesting a year overwrites its vectors.
+
+    Uses the synchronous embeddings client: the async (grpc.aio) client is
+    bound to the event loop it was first used on and does not run under the
+    gevent workers.
+    """
+    collection = _get_company_vectorstore(company_id, create=True)._collection
+    batches = [
+        documents[start : start + EMBED_BATCH_SIZE]
+        for start in range(0, len(documents), EMBED_BATCH_SIZE)
+    ]
+    # At most EMBED_CONCURRENCY batches in flight; each worker writes its batch
+    # as soon as its vectors arrive, overlapping Chroma writes with embedding
+    with ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY) as executor:
+        list(
+            executor.map(
+                lambda batch: _embed_and_upsert(
+                    collection, company_id, batch, embeddings
+                ),
+                batches,
+            )
+        )
+
+
+def _query_cache_key(company_id, user_query):
+    normalized = " ".join(user_query.lower().split())
+    return hashlib.sha256(f"{company_id}:{normalized}".encode()).digest()
+
+
+def _release_query_slot(slot):
+    _query_slot_company[slot] = None
+    _query_slot_documents[slot] = None
+    _query_free_slots.append(slot)
+
+
+def _invalidate_query_cache(company_id):
+    company = str(company_id)
+    with _query_cache_lock:
+        _query_cache_generation[company] = (
+            _query_cache_generation.get(company, 0) + 1
+        )
+        # Scan the slot array rather than the key map so every slot tagged
+        # with the company is freed, even one no key points at
+        stale_slots = {
+            int(slot)
+            for slot in np.flatnonzero(_query_slot_company == company)
+        }
+        stale_keys = [
+            key for key, slot in _query_cache.items() if slot in stale_slots
+        ]
+        for key in stale_keys:
+            del _query_cache[key]
+        for slot in stale_slots:
+            _release_query_slot(slot)
+
+
+def _retrieve_documents(user_query, company_id, embeddings_instance):
+    """
+    Returns the context documents for a query, reusing the results of an
+    identical or near-identical earlier query for the same company.
+    """
+    global _query_vectors
+
+    company = str(company_id)
+    key = _query_cache_key(company_id, user_query)
+    with _query_cache_lock:
+        slot = _query_cache.get(key)
+        if slot is not None:
+            _query_cache.move_to_end(key)
+            return _query_slot_documents[slot]
+        generation = _query_cache_generation.get(company, 0)
+
+    vectorstore = _get_company_vectorstore(company_id)
+    if vectorstore is None:
+        # Nothing uploaded for this company yet
+        return []
+
+    # Network calls run outside the lock
+    query_embedding = embeddings_instance.embed_query(user_query)
+    vector = np.asarray(query_embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+
+    with _query_cache_lock:
+        if (
+            _query_vectors is None
+            or _query_vectors.shape[1] != vector.shape[0]
+        ):
+            _query_vectors = np.zeros(
+                (QUERY_CACHE_SIZE, vector.shape[0]), dtype=np.float32
+            )
+            for stale_slot in _query_cache.values():
+                _release_query_slot(stale_slot)
+            _query_cache.clear()
+
+        company_slots = np.flatnonzero(_query_slot_company == company)
+        if company_slots.size:
+            scores = (_query_vectors @ vector)[company_slots]
+            best = int(np.argmax(scores))
+            if scores[best] >= QUERY_CACHE_SIMILARITY:
+                return _query_slot_documents[company_slots[best]]
+
+    documents = vectorstore.similarity_search_by_vector(query_embedding, k=5)
+
+    with _query_cache_lock:
+        if _query_cache_generation.get(company, 0) != generation:
+            # The company's data changed while we searched; don't cache
+            return documents
+        # Another request may have cached the same query meanwhile; reuse
+        # its slot rather than orphaning one
+        slot = _query_cache.get(key)
+        if slot is None:
+            if not _query_free_slots:
+                _, evicted_slot = _query_cache.popitem(last=False)
+                _release_query_slot(evicted_slot)
+            slot = _query_free_slots.pop()
+            _query_cache[key] = slot
+        else:
+            _query_cache.move_to_end(key)
+        _query_vectors[slot] = vector
+        _query_slot_company[slot] = company
+        _query_slot_documents[slot] = documents
+    return documents
+
+
+def delete_vectors_for_balance_sheet(company_id, years=None):
+    """
+    Deletes the vectors of a company, optionally restricted to the given years.
+    """
+    _invalidate_query_cache(company_id)
+    if _chroma_client is None:
         logger.warning(
-            "ChromaDB vectorstore not initialized. Cannot delete vectors."
+            "ChromaDB client not initialized. Cannot delete vectors."
         )
         return
 
     try:
-        deleted_ids = _vectorstore.delete(
-            where={"company_id": {"$eq": company_id}}
-        )
-        logger.info(
-            f"Deleted vectors for company_id={company_id}. Deleted IDs: {deleted_ids}"
-        )
+        if years is None:
+            # The whole collection belongs to this company, so drop it
+            with _company_vectorstores_lock:
+                _company_vectorstores.pop(str(company_id), None)
+            try:
+                _chroma_client.delete_collection(_collection_name(company_id))
+            except NotFoundError:
+                return
+            logger.info(
+                f"Deleted vector collection for company_id={company_id}."
+            )
+        else:
+            vectorstore = _get_company_vectorstore(company_id)
+            if vectorstore is None:
+                return
+            vectorstore.delete(where={"year": {"$in": list(years)}})
+            logger.info(
+                f"Deleted vectors for company_id={company_id}, years={years}."
+            )
     except Exception as e:
         logger.error(
             f"Error deleting vectors for company_id={company_id}: {e}"
         )
 
 
+def _get_document_chain(llm_instance):
+    """
+    Returns the prompt + LLM chain shared by every company, building it on
+    first use. The company is passed in as the company_id input variable.
+    """
+    global _document_chain
+    if _document_chain is None:
+        _document_chain = create_stuff_documents_chain(
+            llm_instance, CHAT_PROMPT
+        )
+    return _document_chain
+
+
+def _get_chat_memory(user_id, company_id):
+    """
+    Returns the conversation memory for a user and company, creating it on
+    first use. Memory is kept per user and company so users do not see each
+    other's history.
+    """
+    memory_key = f"chat_history_user_{user_id}_company_{company_id}"
+
+    with _memory_store_lock:
+        memory = _memory_store.get(memory_key)
+        if memory is None:
+            memory = ConversationBufferWindowMemory(
+                k=MEMORY_WINDOW_TURNS,
+                memory_key="chat_history",
+                return_messages=True,
+                output_key="answer",
+            )
+        # Re-inserting restarts the TTL, so only idle conversations expire
+        _memory_store[memory_key] = memory
+    return memory
+
+
+def _save_chat_turn(memory, user_query, answer):
+    memory.save_context({"input": user_query}, {"answer": answer})
+    # The window only reads the tail; drop older turns so storage stays bounded
+    del memory.chat_memory.messages[: -2 * MEMORY_WINDOW_TURNS]
+
+
+def _format_sources(source_docs):
+    """Returns the "Sources:" footer appended to chat answers, or ""."""
+    unique_sources = {
+        doc.metadata["source"]
+        for doc in source_docs
+        if "source" in doc.metadata
+    }
+    if not unique_sources:
+        return ""
+    return "\n\nSources:\n" + ", ".join(unique_sources)
+
+
 def generate_chat_response(
     user_query,
     company_id,
@@ -344,91 +658,116 @@ def generate_chat_response(
     embeddings_instance,
     db_session,
     models,
+    user_id=None,
 ):
     """
     Generates a chat response using RAG, filtered by company_id, with conversational memory.
+    Memory is kept per user and company so users do not see each other's history.
     """
-    global _memory_store
-
     if llm_instance is None or embeddings_instance is None:
         logger.error(
             "LLM or Embeddings not initialized. Cannot generate chat response."
         )
         return "AI components are not ready. Please try again later."
 
-    if _vectorstore is None:
+    if _chroma_client is None:
         logger.error("Vector store not initialized. Cannot perform RAG.")
         return "Vector database is not ready. Please upload financial data."
 
     try:
-        memory_key = f"chat_history_company_{company_id}"
-
-        if memory_key not in _memory_store:
-            _memory_store[memory_key] = ConversationBufferMemory(
-                memory_key="chat_history",
-                return_messages=True,
-                output_key="answer",
-            )
-        memory = _memory_store[memory_key]
+        memory = _get_chat_memory(user_id, company_id)
+        document_chain = _get_document_chain(llm_instance)
 
-        retriever = _vectorstore.as_retriever(
-            search_kwargs={"k": 5, "filter": {"company_id": company_id}}
+        source_docs = _retrieve_documents(
+            user_query, company_id, embeddings_instance
         )
-
-        system_prompt = (
-            "You are a financial analyst AI assistant specializing in balance sheet analysis. "
-            f"You have access to structured financial data for company ID {company_id}. "
-            "Use the provided context to answer questions about financial metrics, trends, and insights. "
-            "Be precise, analytical, and provide specific numbers from the data when available. "
-            "If you cannot find relevant information in the context, clearly state that. "
-            "Keep your responses concise but informative. "
-            "Only use the information provided in the context.\n\n"
-            "Context:\n{context}"
+        if not source_docs:
+            # Nothing to ground an answer in; skip the LLM round-trip
+            return NO_DATA_RESPONSE
+
+        chat_history = memory.load_memory_variables({})["chat_history"]
+
+        answer = document_chain.invoke(
+            {
+                "input": user_query,
+                "chat_history": chat_history,
+                "context": source_docs,
+                "company_id": company_id,
+            }
         )
 
-        prompt = ChatPromptTemplate.from_messages(
-            [
-                ("system", system_prompt),
-                MessagesPlaceholder("chat_history"),
-                ("human", "{input}"),
-            ]
-        )
+        _save_chat_turn(memory, user_query, answer)
 
-        document_chain = create_stuff_documents_chain(llm_instance, prompt)
-        retrieval_chain = create_retrieval_chain(retriever, document_chain)
+        response_text = answer or NO_DATA_RESPONSE
 
-        chat_history = memory.chat_memory.messages
+        # logger.info(f"Retrieved context documents: {source_docs}")
 
-        response = retrieval_chain.invoke(
-            {"input": user_query, "chat_history": chat_history}
-        )
+        return response_text + _format_sources(source_docs)
 
-        memory.save_context(
-            {"input": user_query}, {"answer": response["answer"]}
+    except Exception as e:
+        logger.error(
+            f"Error generating chat response for company_id {company_id}: {e}"
         )
+        return f"An internal error occurred while processing your request: {str(e)}"
 
-        response_text = response.get(
-            "answer",
-            "I cannot answer this question based on the available financial data.",
+
+def stream_chat_response(
+    user_query,
+    company_id,
+    llm_instance,
+    embeddings_instance,
+    user_id=None,
+):
+    """
+    Same as generate_chat_response, but yields the answer in text chunks as
+    the LLM produces them. The turn is saved to memory once the stream ends.
+    """
+    if llm_instance is None or embeddings_instance is None:
+        logger.error(
+            "LLM or Embeddings not initialized. Cannot generate chat response."
         )
-        source_docs = response.get("context", [])
+        yield "AI components are not ready. Please try again later."
+        return
 
-        # logger.info(f"Retrieved context documents: {source_docs}")
+    if _chroma_client is None:
+        logger.error("Vector store not initialized. Cannot perform RAG.")
+        yield "Vector database is not ready. Please upload financial data."
+        return
 
-        if source_docs:
-            source_info = "\n\nSources:"
-            unique_sources = set()
-            for doc in source_docs:
-                if "source" in doc.metadata:
-                    unique_sources.add(doc.metadata["source"])
-            if unique_sources:
-                source_info += "\n" + ", ".join(list(unique_sources))
-                response_text += source_info
+    try:
+        memory = _get_chat_memory(user_id, company_id)
+        document_chain = _get_document_chain(llm_instance)
 
-        return response_text
+        source_docs = _retrieve_documents(
+            user_query, company_id, embeddings_instance
+        )
+        if not source_docs:
+            yield NO_DATA_RESPONSE
+            return
+
+        chat_history = memory.load_memory_variables({})["chat_history"]
+
+        chunks = []
+        for chunk in document_chain.stream(
+            {
+                "input": user_query,
+                "chat_history": chat_history,
+                "context": source_docs,
+                "company_id": company_id,
+            }
+        ):
+            chunks.append(chunk)
+            yield chunk
+
+        answer = "".join(chunks)
+        _save_chat_turn(memory, user_query, answer)
+
+        if not answer:
+            yield NO_DATA_RESPONSE
+        yield _format_sources(source_docs)
 
     except Exception as e:
         logger.error(
-            f"Error generating chat response for company_id {company_id}: {e}"
+            f"Error streaming chat response for company_id {company_id}: {e}"
         )
-        return f"An internal error occurred while processing your request: {str(e)}"
+        yield f"An internal error occurred while processing your request: {str(e)}"
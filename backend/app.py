@@ -1,24 +1,41 @@
 # backend/app.py
 
 import os
-import json
+import threading
 import traceback
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from collections import namedtuple
+import orjson
+from cachetools import TTLCache
 from dotenv import load_dotenv
-from flask import Flask, jsonify, request, g
+from flask import (
+    Flask,
+    Response,
+    jsonify,
+    request,
+    g,
+    stream_with_context,
+)
+from flask.json.provider import JSONProvider
 from flask_jwt_extended import (
     JWTManager,
     create_access_token,
+    create_refresh_token,
     jwt_required,
+    get_jwt,
     get_jwt_identity,
     unset_jwt_cookies,
 )
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import timedelta
 import logging
-from functools import wraps
+from functools import lru_cache, wraps
 import click
+from flask_compress import Compress
 from flask_cors import CORS
+from sqlalchemy import delete, select, update
+from sqlalchemy.engine import make_url
 from ai_model import process_structured_financial_data
 from werkzeug.utils import secure_filename
 import models
@@ -30,13 +47,20 @@ from models import (
     ROLE_ADMIN,
     ROLE_CEO,
     ROLE_ANALYST,
+    ALL_ROLES,
 )
 from ai_model import (
     initialize_ai_components,
     generate_chat_response,
+    stream_chat_response,
     delete_vectors_for_balance_sheet,
 )
 
+try:
+    from gevent import get_hub, monkey
+except ImportError:  # running without gevent, e.g. the dev server
+    monkey = None
+
 load_dotenv()
 
 # Logger setup
@@ -47,48 +71,253 @@ logger = logging.getLogger(__name__)
 llm = None
 embeddings = None
 
+# werkzeug's default KDF, made explicit so it can be tuned per deployment.
+# Hashes made with a different method are upgraded on the next login.
+PASSWORD_HASH_METHOD = os.environ.get(
+    "PASSWORD_HASH_METHOD", "scrypt:32768:8:1"
+)
+
+# The fields of the JWT's user that authorization and logging need. They
+# travel as access token claims, so most requests never load the User row.
+CurrentUser = namedtuple("CurrentUser", "id username role company_id")
+
+BALANCE_SHEET_DELETE_ROLES = frozenset({ROLE_ADMIN, ROLE_CEO})
+UPLOAD_EXTENSIONS = frozenset({".csv", ".xlsx"})
+
+# (role, company_id) -> authorized company IDs, cleared on company changes
+_authorized_company_ids_cache = TTLCache(maxsize=1024, ttl=60)
+_authorized_company_ids_lock = threading.Lock()
+
+# Last database probe made by /api/health, reused for a few seconds so
+# frequent monitoring pings don't each hit the database
+_health_db_cache = TTLCache(maxsize=1, ttl=5)
+_health_db_lock = threading.Lock()
+
 # --- Helper Functions (keep these as they are) ---
 
 
 def hash_pwd(password):
-    return generate_password_hash(password)
+    return generate_password_hash(password, method=PASSWORD_HASH_METHOD)
+
+
+def verify_pwd(password_hash, password):
+    """
+    Checks a password against its stored hash. Under gevent the KDF runs on
+    the hub's native thread pool; run inline it would stall every other
+    greenlet in the worker for the whole hash.
+    """
+    if monkey is not None and monkey.is_module_patched("threading"):
+        return get_hub().threadpool.apply(
+            check_password_hash, (password_hash, password)
+        )
+    return check_password_hash(password_hash, password)
+
+
+@lru_cache(maxsize=1)
+def dummy_password_hash():
+    """
+    Hash checked when the username doesn't exist, so an unknown user costs
+    the same KDF work as a wrong password and can't be told apart by timing.
+    """
+    return hash_pwd(uuid.uuid4().hex)
+
+
+def needs_rehash(password_hash):
+    return not password_hash.startswith(f"{PASSWORD_HASH_METHOD}$")
+
+
+class OrjsonProvider(JSONProvider):
+    """JSON provider that serializes request and response bodies with orjson."""
+
+    # Integer-keyed dicts (e.g. processed years) and naive datetimes as UTC
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_NAIVE_UTC
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=self.options).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the response, skipping the
+        # bytes -> str -> bytes round trip the base class would do
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, option=self.options | orjson.OPT_APPEND_NEWLINE),
+            mimetype="application/json",
+        )
+
+
+def create_user_access_token(user):
+    return create_access_token(
+        identity=str(user.id),
+        additional_claims={
+            "username": user.username,
+            "role": user.role,
+            "company_id": user.company_id,
+        },
+    )
+
+
+def load_current_user():
+    """
+    Returns the JWT's user as a CurrentUser, read from the token's claims.
+    Tokens issued without them fall back to a lookup, which returns None if
+    the user no longer exists.
+    """
+    if "current_user" not in g:
+        claims = get_jwt()
+        if "role" in claims:
+            g.current_user = CurrentUser(
+                int(claims["sub"]),
+                claims["username"],
+                claims["role"],
+                claims["company_id"],
+            )
+        else:
+            row = db.session.execute(
+                select(
+                    User.id, User.username, User.role, User.company_id
+                ).where(User.id == int(get_jwt_identity()))
+            ).first()
+            g.current_user = CurrentUser(*row) if row else None
+    return g.current_user
+
+
+def current_authorized_company_ids():
+    """get_authorized_company_ids for the JWT's user, once per request."""
+    if "authorized_company_ids" not in g:
+        g.authorized_company_ids = get_authorized_company_ids(
+            load_current_user()
+        )
+    return g.authorized_company_ids
 
 
 def get_authorized_company_ids(user):
     """
     Determines which company IDs a user is authorized to view.
+    Results are cached per (role, company_id) for a short TTL.
     """
+    cache_key = (user.role, user.company_id)
+    with _authorized_company_ids_lock:
+        authorized_ids = _authorized_company_ids_cache.get(cache_key)
+    if authorized_ids is None:
+        authorized_ids = _query_authorized_company_ids(user)
+        with _authorized_company_ids_lock:
+            _authorized_company_ids_cache[cache_key] = authorized_ids
+    return authorized_ids
+
+
+def clear_authorized_company_ids_cache():
+    with _authorized_company_ids_lock:
+        _authorized_company_ids_cache.clear()
+
+
+def _query_authorized_company_ids(user):
     if user.role == ROLE_ADMIN:
         # Admins can see all companies
-        return [c.id for c in Company.query.all()]
+        return db.session.execute(select(Company.id)).scalars().all()
     elif user.role == ROLE_CEO:
-        # CEOs can see their assigned company and any direct child companies
-        ceo_company = Company.query.get(user.company_id)
-        if ceo_company:
-            authorized_ids = [ceo_company.id]
-            child_companies = Company.query.filter_by(
-                parent_company_id=ceo_company.id
-            ).all()
-            authorized_ids.extend([c.id for c in child_companies])
-            return list(set(authorized_ids))  # Use set to remove duplicates
-        return []
+        # CEOs can see their assigned company and every company below it,
+        # fetched in one recursive query. UNION (not UNION ALL) also stops
+        # the recursion if a parent_company_id cycle ever slips in.
+        if not user.company_id:
+            return []
+        hierarchy = (
+            select(Company.id)
+            .where(Company.id == user.company_id)
+            .cte("company_hierarchy", recursive=True)
+        )
+        hierarchy = hierarchy.union(
+            select(Company.id).where(
+                Company.parent_company_id == hierarchy.c.id
+            )
+        )
+        return db.session.execute(select(hierarchy.c.id)).scalars().all()
     elif user.role == ROLE_ANALYST:
         # Analysts can only see their assigned company
         return [user.company_id] if user.company_id else []
     return []
 
 
+# Columns, in order, of the rows _metrics_payload() expects
+METRIC_COLUMNS = (
+    BalanceSheet.year,
+    BalanceSheet.revenue,
+    BalanceSheet.net_income,
+    BalanceSheet.assets,
+    BalanceSheet.liabilities,
+)
+
+
+def _metrics_payload(company_name, currency, rows):
+    """
+    Shapes METRIC_COLUMNS rows (newest year first) into the chart payload
+    returned by the company metrics endpoints, transposing them into one
+    list per column.
+    """
+    years, revenue, net_income, assets, liabilities = map(list, zip(*rows))
+    return {
+        "company_name": company_name,
+        "currency": currency,
+        "years": years,
+        "revenue": revenue,
+        "netIncome": net_income,
+        "assets": assets,
+        "liabilities": liabilities,
+    }
+
+
+def cacheable_json(payload):
+    """
+    JSON response with an ETag of its body. The browser revalidates on each
+    use and gets an empty 304 back when the data has not changed.
+    """
+    response = jsonify(payload)
+    response.add_etag()
+    # Always revalidate: a max-age would show stale lists after an edit
+    response.headers["Cache-Control"] = "private, no-cache"
+
+    # flask-compress sends compressed bodies with the ETag "<etag>:<encoding>";
+    # the encoding doesn't change the content, so either form is a match
+    etag, _ = response.get_etag()
+    if any(
+        tag.split(":", 1)[0] == etag for tag in request.if_none_match.as_set()
+    ):
+        response.status_code = 304
+    return response
+
+
+def user_required(fn):
+    """
+    Like jwt_required, but also puts the token's user into g.current_user.
+
+    The user is built from the access token's claims without touching the
+    database, so a deleted or demoted user keeps their old access until the
+    token expires (JWT_ACCESS_TOKEN_EXPIRES, 15 minutes). Only tokens issued
+    before the claims existed are looked up, answering 404 if that user no
+    longer exists.
+    """
+
+    @wraps(fn)
+    @jwt_required()
+    def decorator(*args, **kwargs):
+        if load_current_user() is None:
+            return jsonify({"msg": "User not found"}), 404
+        return fn(*args, **kwargs)
+
+    return decorator
+
+
 def require_role(roles):
     """Decorator to restrict access based on user roles."""
+    roles = frozenset(roles)  # built once per route, not per request
 
     def wrapper(fn):
         @wraps(fn)
         @jwt_required()
         def decorator(*args, **kwargs):
-            # get_jwt_identity() will now return a string (the user ID)
-            g.current_user = User.query.get(
-                int(get_jwt_identity())
-            )  # Cast back to int for DB query
+            load_current_user()
             if g.current_user is None or g.current_user.role not in roles:
                 logger.warning(
                     f"Unauthorized access attempt by user {g.current_user.username if g.current_user else 'None'} with role {g.current_user.role if g.current_user else 'None'}. Required roles: {roles}"
@@ -109,16 +338,51 @@ def require_role(roles):
 
 def create_app():
     app = Flask(__name__)
-    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///oculis.sqlite"
+    app.json = OrjsonProvider(app)
+
+    # Compress JSON responses (zstd/br/gzip, whichever the client accepts).
+    # Streamed chat output is left alone so tokens aren't held in a buffer.
+    app.config["COMPRESS_MIMETYPES"] = ["application/json"]
+    app.config["COMPRESS_MIN_SIZE"] = 500
+    app.config["COMPRESS_STREAMS"] = False
+    Compress(app)
+
+    # Set OCULIS_PROFILE=1 to write a cProfile .prof file per request
+    # (open them with snakeviz or tuna). Off by default, and free when off.
+    app.config["PROFILE_DIR"] = os.environ.get(
+        "OCULIS_PROFILE_DIR", "profiler_results"
+    )
+    if os.environ.get("OCULIS_PROFILE"):
+        from werkzeug.middleware.profiler import ProfilerMiddleware
+
+        os.makedirs(app.config["PROFILE_DIR"], exist_ok=True)
+        app.wsgi_app = ProfilerMiddleware(
+            app.wsgi_app,
+            profile_dir=app.config["PROFILE_DIR"],
+            restrictions=[30],
+        )
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get(
+        "SQLALCHEMY_DATABASE_URI", "sqlite:///oculis.sqlite"
+    )
+    engine_options = {"pool_pre_ping": True}
+    if (
+        make_url(app.config["SQLALCHEMY_DATABASE_URI"]).get_backend_name()
+        == "sqlite"
+    ):
+        # Pooled SQLite connections move between threads/greenlets
+        engine_options["connect_args"] = {"check_same_thread": False}
+        engine_options["pool_size"] = 10
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options
     app.config["JWT_SECRET_KEY"] = os.environ.get(
         "JWT_SECRET_KEY", "super-secret-jwt-key"
     )
-    app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(hours=24)
+    # Role and company ride in the access token, so keep it short-lived and
+    # let the client refresh it to pick up changes
+    app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(minutes=15)
+    app.config["JWT_REFRESH_TOKEN_EXPIRES"] = timedelta(hours=24)
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-    app.config["UPLOAD_FOLDER"] = "uploads"  # Directory to save uploaded files
-    os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
 
     # Initialize CORS for your frontend origin
     CORS(
@@ -149,13 +413,12 @@ def create_app():
     jwt = JWTManager(app)
 
     # Initialize AI components
-    global llm, embeddings, vectorstore
-    llm, embeddings, vectorstore = initialize_ai_components()
+    global llm, embeddings, chroma_client
+    llm, embeddings, chroma_client = initialize_ai_components()
+    app.extensions["chroma_client"] = chroma_client
 
-    @app.before_request
-    def inject_ai_components():
-        g.llm = llm
-        g.embeddings = embeddings
+    with app.app_context():
+        db.create_all()
 
     # --- CLI Command for Database Seeding ---
     @app.cli.command("seed-db")
@@ -170,23 +433,15 @@ def create_app():
             if force or not User.query.first():
                 logger.info("Seeding initial users and companies...")
 
+                # Everything below runs in one transaction with a single
+                # commit at the end; flush() hands out IDs without an fsync.
                 # Clear existing data if force is true or no users exist
                 if force:
                     db.session.query(BalanceSheet).delete()
                     db.session.query(User).delete()
                     db.session.query(Company).delete()
-                    db.session.commit()
                     logger.info("Cleared existing database data.")
 
-                # Admin User
-                admin = User(
-                    username="ambani_family",
-                    password_hash=hash_pwd("adminpass"),
-                    role=ROLE_ADMIN,
-                    email="admin@example.com",
-                )
-                db.session.add(admin)
-
                 # Companies
                 reliance_industries = Company(
                     name="Reliance Industries Ltd.", currency="INR"
@@ -217,76 +472,98 @@ def create_app():
                         hdfc_bank,
                     ]
                 )
-                db.session.commit()  # Commit companies to get their IDs
+                db.session.flush()  # Flush companies to get their IDs
 
-                # Set up parent-child relationships after commit
+                # Set up parent-child relationships after flush
                 jio_platforms.parent_company_id = reliance_industries.id
                 reliance_retail.parent_company_id = reliance_industries.id
-                db.session.commit()
 
-                # CEO Users
-                jio_ceo = User(
-                    username="jio_ceo",
-                    password_hash=hash_pwd("jioceo123"),
-                    role=ROLE_CEO,
-                    company_id=jio_platforms.id,
-                    email="jio.ceo@example.com",
-                )
-                reliance_retail_ceo = User(
-                    username="reliance_retail_ceo",
-                    password_hash=hash_pwd("retailceo123"),
-                    role=ROLE_CEO,
-                    company_id=reliance_retail.id,
-                    email="retail.ceo@example.com",
-                )
-                tata_motors_ceo = User(
-                    username="tata_motors_ceo",
-                    password_hash=hash_pwd("tataceo123"),
-                    role=ROLE_CEO,
-                    company_id=tata_motors.id,
-                    email="tata.ceo@example.com",
-                )
-                db.session.add_all(
-                    [jio_ceo, reliance_retail_ceo, tata_motors_ceo]
-                )
-
-                # Analyst Users
-                reliance_analyst = User(
-                    username="reliance_analyst",
-                    password_hash=hash_pwd("relanalyst123"),
-                    role=ROLE_ANALYST,
-                    company_id=reliance_industries.id,
-                    email="reliance.analyst@example.com",
-                )
-                jio_analyst = User(
-                    username="jio_analyst",
-                    password_hash=hash_pwd("jioanalyst123"),
-                    role=ROLE_ANALYST,
-                    company_id=jio_platforms.id,
-                    email="jio.analyst@example.com",
-                )
-                infosys_analyst = User(
-                    username="infosys_analyst",
-                    password_hash=hash_pwd("infy_anl"),
-                    role=ROLE_ANALYST,
-                    company_id=infosys.id,
-                    email="infosys.analyst@example.com",
-                )
-                dmart_analyst = User(
-                    username="dmart_analyst",
-                    password_hash=hash_pwd("dmart_anl"),
-                    role=ROLE_ANALYST,
-                    company_id=dmart.id,
-                    email="dmart.analyst@example.com",
-                )
-                db.session.add_all(
-                    [
-                        reliance_analyst,
-                        jio_analyst,
-                        infosys_analyst,
-                        dmart_analyst,
-                    ]
-                )
+                # Hash the seed passwords in parallel; the KDF releases the
+                # GIL. Each scrypt hash holds ~32 MB, so the pool is capped
+                # by CPU count (one worker on the single-CPU deployment).
+                seed_passwords = [
+                    "adminpass",
+                    "jioceo123",
+                    "retailceo123",
+                    "tataceo123",
+                    "relanalyst123",
+                    "jioanalyst123",
+                    "infy_anl",
+                    "dmart_anl",
+                ]
+                with ThreadPoolExecutor(
+                    max_workers=min(4, os.cpu_count() or 1)
+                ) as executor:
+                    password_hashes = dict(
+                        zip(
+                            seed_passwords,
+                            executor.map(hash_pwd, seed_passwords),
+                        )
+                    )
+
+                # Users, inserted with a single executemany batch
+                seed_users = [
+                    # Admin User
+                    {
+                        "username": "ambani_family",
+                        "password_hash": password_hashes["adminpass"],
+                        "role": ROLE_ADMIN,
+                        "company_id": None,
+                        "email": "admin@example.com",
+                    },
+                    # CEO Users
+                    {
+                        "username": "jio_ceo",
+                        "password_hash": password_hashes["jioceo123"],
+                        "role": ROLE_CEO,
+                        "company_id": jio_platforms.id,
+                        "email": "jio.ceo@example.com",
+                    },
+                    {
+                        "username": "reliance_retail_ceo",
+                        "password_hash": password_hashes["retailceo123"],
+                        "role": ROLE_CEO,
+                        "company_id": reliance_retail.id,
+                        "email": "retail.ceo@example.com",
+                    },
+                    {
+                        "username": "tata_motors_ceo",
+                        "password_hash": password_hashes["tataceo123"],
+                        "role": ROLE_CEO,
+                        "company_id": tata_motors.id,
+                        "email": "tata.ceo@example.com",
+                    },
+                    # Analyst Users
+                    {
+                        "username": "reliance_analyst",
+                        "password_hash": password_hashes["relanalyst123"],
+                        "role": ROLE_ANALYST,
+                        "company_id": reliance_industries.id,
+                        "email": "reliance.analyst@example.com",
+                    },
+                    {
+                        "username": "jio_analyst",
+                        "password_hash": password_hashes["jioanalyst123"],
+                        "role": ROLE_ANALYST,
+                        "company_id": jio_platforms.id,
+                        "email": "jio.analyst@example.com",
+                    },
+                    {
+                        "username": "infosys_analyst",
+                        "password_hash": password_hashes["infy_anl"],
+                        "role": ROLE_ANALYST,
+                        "company_id": infosys.id,
+                        "email": "infosys.analyst@example.com",
+                    },
+                    {
+                        "username": "dmart_analyst",
+                        "password_hash": password_hashes["dmart_anl"],
+                        "role": ROLE_ANALYST,
+                        "company_id": dmart.id,
+                        "email": "dmart.analyst@example.com",
+                    },
+                ]
+                db.session.execute(User.__table__.insert(), seed_users)
 
                 db.session.commit()
                 logger.info("Users and companies seeded successfully.")
@@ -316,7 +593,7 @@ def create_app():
         if User.query.filter_by(username=username).first():
             return jsonify({"msg": "User already exists"}), 409
 
-        if role not in [ROLE_ADMIN, ROLE_CEO, ROLE_ANALYST]:
+        if role not in ALL_ROLES:
             return jsonify({"msg": "Invalid role specified"}), 400
 
         if role != ROLE_ADMIN and not company_id:
@@ -328,7 +605,7 @@ def create_app():
             )
 
         if company_id:
-            company = Company.query.get(company_id)
+            company = db.session.get(Company, company_id)
             if not company:
                 return jsonify({"msg": "Company not found"}), 404
 
@@ -353,15 +630,29 @@ def create_app():
     def login():
         username = request.json.get("username", None)
         password = request.json.get("password", None)
+        # Check before hashing: the hasher fails on a missing password
+        if not (
+            isinstance(username, str)
+            and isinstance(password, str)
+            and username
+            and password
+        ):
+            return jsonify({"msg": "Username and password are required"}), 400
 
         user = User.query.filter_by(username=username).first()
+        password_hash = user.password_hash if user else dummy_password_hash()
 
-        if user and check_password_hash(user.password_hash, password):
-            access_token = create_access_token(identity=str(user.id))
+        if verify_pwd(password_hash, password) and user:
+            if needs_rehash(user.password_hash):
+                user.password_hash = hash_pwd(password)
+                db.session.commit()
+            access_token = create_user_access_token(user)
+            refresh_token = create_refresh_token(identity=str(user.id))
             logger.info(f"User {username} logged in successfully.")
             return (
                 jsonify(
                     access_token=access_token,
+                    refresh_token=refresh_token,
                     username=user.username,
                     role=user.role,
                 ),
@@ -371,6 +662,15 @@ def create_app():
             logger.warning(f"Failed login attempt for username: {username}")
             return jsonify({"msg": "Bad username or password"}), 401
 
+    @app.route("/api/refresh", methods=["POST"])
+    @jwt_required(refresh=True)
+    def refresh():
+        """Issues a new access token with the user's current role and company."""
+        user = db.session.get(User, int(get_jwt_identity()))
+        if not user:
+            return jsonify({"msg": "User not found"}), 401
+        return jsonify(access_token=create_user_access_token(user)), 200
+
     @app.route("/api/logout", methods=["POST"])
     @jwt_required()
     def logout():
@@ -381,7 +681,7 @@ def create_app():
     @jwt_required()
     def get_current_user_info():
         user_id = int(get_jwt_identity())
-        user = User.query.get(user_id)
+        user = db.session.get(User, user_id)
         if user:
             return (
                 jsonify(
@@ -400,23 +700,18 @@ def create_app():
     @app.route("/api/users", methods=["GET"])
     @require_role([ROLE_ADMIN])
     def get_all_users():
-        users = User.query.all()
-        users_data = [
-            {
-                "id": u.id,
-                "username": u.username,
-                "role": u.role,
-                "company_id": u.company_id,
-                "email": u.email,
-            }
-            for u in users
-        ]
-        return jsonify(users_data), 200
+        # Plain rows, not ORM objects: this list is read-only
+        users = db.session.execute(
+            select(
+                User.id, User.username, User.role, User.company_id, User.email
+            )
+        )
+        return jsonify([user._asdict() for user in users]), 200
 
     @app.route("/api/users/<int:user_id>", methods=["GET"])
     @require_role([ROLE_ADMIN])
     def get_user_by_id(user_id):
-        user = User.query.get(user_id)
+        user = db.session.get(User, user_id)
         if user:
             return (
                 jsonify(
@@ -435,11 +730,14 @@ def create_app():
     @app.route("/api/users/<int:user_id>", methods=["PUT"])
     @require_role([ROLE_ADMIN])
     def update_user(user_id):
-        user = User.query.get(user_id)
+        user = db.session.get(User, user_id)
         if not user:
             return jsonify({"msg": "User not found"}), 404
 
         data = request.get_json()
+        if data.get("role", user.role) not in ALL_ROLES:
+            return jsonify({"msg": "Invalid role specified"}), 400
+
         user.username = data.get("username", user.username)
         user.role = data.get("role", user.role)
         user.email = data.get("email", user.email)
@@ -447,7 +745,7 @@ def create_app():
         new_company_id = data.get("company_id")
         if user.role != ROLE_ADMIN:
             if new_company_id:
-                company = Company.query.get(new_company_id)
+                company = db.session.get(Company, new_company_id)
                 if not company:
                     return jsonify({"msg": "Company not found"}), 404
                 user.company_id = new_company_id
@@ -462,7 +760,7 @@ def create_app():
     @app.route("/api/users/<int:user_id>", methods=["DELETE"])
     @require_role([ROLE_ADMIN])
     def delete_user(user_id):
-        user = User.query.get(user_id)
+        user = db.session.get(User, user_id)
         if not user:
             return jsonify({"msg": "User not found"}), 404
         db.session.delete(user)
@@ -489,7 +787,7 @@ def create_app():
             )
 
         if parent_company_id:
-            parent_company = Company.query.get(parent_company_id)
+            parent_company = db.session.get(Company, parent_company_id)
             if not parent_company:
                 return jsonify({"msg": "Parent company not found"}), 404
 
@@ -498,6 +796,7 @@ def create_app():
         )
         db.session.add(new_company)
         db.session.commit()
+        clear_authorized_company_ids_cache()
         return (
             jsonify(
                 {
@@ -509,22 +808,19 @@ def create_app():
         )
 
     @app.route("/api/companies", methods=["GET"])
-    @jwt_required()
+    @user_required
     def get_companies():
-        user_id = int(get_jwt_identity())
-        current_user = User.query.get(user_id)
-
-        if not current_user:
-            return jsonify({"msg": "User not found"}), 404
-
-        authorized_company_ids = get_authorized_company_ids(current_user)
+        authorized_company_ids = current_authorized_company_ids()
 
         if not authorized_company_ids:
-            return jsonify([]), 200
-
-        companies = Company.query.filter(
-            Company.id.in_(authorized_company_ids)
-        ).all()
+            return cacheable_json([])
+
+        companies = db.session.query(
+            Company.id,
+            Company.name,
+            Company.currency,
+            Company.parent_company_id,
+        ).filter(Company.id.in_(authorized_company_ids))
         companies_data = [
             {
                 "id": c.id,
@@ -534,21 +830,17 @@ def create_app():
             }
             for c in companies
         ]
-        return jsonify(companies_data), 200
+        return cacheable_json(companies_data)
 
     @app.route("/api/companies/<int:company_id>", methods=["GET"])
-    @jwt_required()
+    @user_required
     def get_company_by_id(company_id):
-        user_id = int(get_jwt_identity())
-        current_user = User.query.get(user_id)
-
-        if not current_user:
-            return jsonify({"msg": "User not found"}), 404
+        current_user = g.current_user
 
-        authorized_company_ids = get_authorized_company_ids(current_user)
+        authorized_company_ids = current_authorized_company_ids()
         if company_id not in authorized_company_ids:
             logger.warning(
-                f"User {current_user.username} (ID: {user_id}) attempted to access unauthorized company ID: {company_id}"
+                f"User {current_user.username} (ID: {current_user.id}) attempted to access unauthorized company ID: {company_id}"
             )
             return (
                 jsonify(
@@ -557,7 +849,7 @@ def create_app():
                 403,
             )
 
-        company = Company.query.get(company_id)
+        company = db.session.get(Company, company_id)
         if company:
             return (
                 jsonify(
@@ -575,99 +867,123 @@ def create_app():
     @app.route("/api/companies/<int:company_id>", methods=["PUT"])
     @require_role([ROLE_ADMIN])
     def update_company(company_id):
-        company = Company.query.get(company_id)
+        company = db.session.get(Company, company_id)
         if not company:
             return jsonify({"msg": "Company not found"}), 404
 
         data = request.get_json()
-        company.name = data.get("name", company.name)
-        company.currency = data.get("currency", company.currency)
-        company.parent_company_id = data.get(
+        # Validate the new parent before assigning anything: with foreign
+        # keys enforced, the lookup's autoflush would otherwise write a
+        # dangling parent_company_id and fail with an IntegrityError
+        parent_company_id = data.get(
             "parent_company_id", company.parent_company_id
         )
-
-        if company.parent_company_id is not None:
-            parent_company = Company.query.get(company.parent_company_id)
+        if parent_company_id is not None:
+            parent_company = db.session.get(Company, parent_company_id)
             if not parent_company:
                 return jsonify({"msg": "Parent company not found"}), 404
-            if company.id == company.parent_company_id:
+            if company.id == parent_company_id:
                 return (
                     jsonify({"msg": "Company cannot be its own parent"}),
                     400,
                 )
 
+        company.name = data.get("name", company.name)
+        company.currency = data.get("currency", company.currency)
+        company.parent_company_id = parent_company_id
         db.session.commit()
+        clear_authorized_company_ids_cache()
         return jsonify({"msg": "Company updated successfully"}), 200
 
     @app.route("/api/companies/<int:company_id>", methods=["DELETE"])
     @require_role([ROLE_ADMIN])
     def delete_company(company_id):
-        company = Company.query.get(company_id)
+        company = db.session.get(Company, company_id)
         if not company:
             return jsonify({"msg": "Company not found"}), 404
 
-        User.query.filter_by(company_id=company_id).update(
-            {"company_id": None}
+        # One DML statement per table, with no rows loaded into the session.
+        # New databases also carry these as ON DELETE rules; spelling them
+        # out keeps databases created before those rules working.
+        db.session.execute(
+            update(User)
+            .where(User.company_id == company_id)
+            .values(company_id=None)
         )
-        BalanceSheet.query.filter_by(company_id=company_id).delete()
-
-        db.session.delete(company)
+        db.session.execute(
+            update(Company)
+            .where(Company.parent_company_id == company_id)
+            .values(parent_company_id=None)
+        )
+        db.session.execute(
+            delete(BalanceSheet).where(BalanceSheet.company_id == company_id)
+        )
+        db.session.execute(delete(Company).where(Company.id == company_id))
         db.session.commit()
+        clear_authorized_company_ids_cache()
+        delete_vectors_for_balance_sheet(company_id)
         return jsonify({"msg": "Company deleted successfully"}), 200
 
     # --- Balance Sheet Routes ---
     @app.route("/api/balance_sheets", methods=["POST"])
+    @user_required
     def upload_balance_sheet():
+        # Reject malformed requests before touching the database or the
+        # upload's contents
         if "file" not in request.files:
             return jsonify({"error": "No file part"}), 400
         if "company_id" not in request.form:
             return jsonify({"error": "Company ID is required"}), 400
 
         file = request.files["file"]
-        company_id = request.form["company_id"]
         year = None
 
         if file.filename == "":
             return jsonify({"error": "No selected file"}), 400
 
-        company = Company.query.get(company_id)
-        if not company:
-            return jsonify({"error": "Company not found"}), 404
-
-        filename = f"{uuid.uuid4().hex}_{secure_filename(file.filename)}"
-        filepath = os.path.join(app.config["UPLOAD_FOLDER"], filename)
+        filename = secure_filename(file.filename)
+        file_extension = os.path.splitext(filename)[1].lower()
+        if file_extension not in UPLOAD_EXTENSIONS:
+            return (
+                jsonify(
+                    {
+                        "error": "Unsupported file type. Only CSV and Excel files are allowed."
+                    }
+                ),
+                400,
+            )
 
         try:
-            file_extension = os.path.splitext(filename)[1].lower()
-            if file_extension not in [".csv", ".xlsx"]:
-                return (
-                    jsonify(
-                        {
-                            "error": "Unsupported file type. Only CSV and Excel files are allowed."
-                        }
-                    ),
-                    400,
-                )
+            company_id = int(request.form["company_id"])
+        except ValueError:
+            return jsonify({"error": "Company ID must be an integer"}), 400
 
-            file.save(filepath)
-            logger.info(f"File saved to {filepath}")
+        current_user = g.current_user
+        if company_id not in current_authorized_company_ids():
+            logger.warning(
+                f"User {current_user.username} (ID: {current_user.id}) attempted to upload a balance sheet for unauthorized company ID: {company_id}"
+            )
+            return (
+                jsonify(
+                    {
+                        "error": "Forbidden: Not authorized to upload balance sheets for this company"
+                    }
+                ),
+                403,
+            )
 
-            # Delete existing balance sheet data and vectors for this company and year
-            # This ensures we don't have duplicate or old data for the same year/company
-            existing_bs = BalanceSheet.query.filter_by(
-                company_id=company_id
-            ).first()
-            if existing_bs:
-                db.session.delete(existing_bs)
-                db.session.commit()
-                logger.info(
-                    f"Deleted existing balance sheet entry for Company ID: {company_id}"
-                )
-                delete_vectors_for_balance_sheet(company_id)
+        company = db.session.get(Company, company_id)
+        if not company:
+            return jsonify({"error": "Company not found"}), 404
 
-            # Process the structured financial data from the uploaded file
+        try:
+            # Parse straight from the upload stream. Werkzeug already keeps
+            # small uploads in memory and spools large ones to a temp file,
+            # so there is no need to save a copy and read it back. Existing
+            # rows and vectors are replaced per uploaded year inside.
             processed_data = process_structured_financial_data(
-                filepath,
+                file.stream,
+                file_extension,
                 company_id,
                 embeddings,  # Pass embeddings for vector store update
                 db.session,  # Pass db session for saving to BalanceSheet model
@@ -682,6 +998,8 @@ def create_app():
                     ),
                     422,
                 )
+            if processed_data.get("status") != "success":
+                return jsonify({"error": processed_data.get("message")}), 422
 
             logger.info(
                 f"Processed data for {company_id}, {year}: {processed_data}"
@@ -696,6 +1014,8 @@ def create_app():
                         "message": "Balance sheet uploaded and processed successfully",
                         "company_id": company_id,
                         "filename": filename,
+                        # Year -> metrics; the int keys need OPT_NON_STR_KEYS
+                        "processed_years": processed_data["processed_years"],
                         "extracted_metrics": {
                             "revenue": processed_data.get("revenue"),
                             "net_income": processed_data.get("net_income"),
@@ -714,24 +1034,15 @@ def create_app():
             )
             logger.error(traceback.format_exc())  # Log full traceback
             return jsonify({"error": f"Internal server error: {str(e)}"}), 500
-        finally:
-            # Clean up the uploaded file after processing
-            if os.path.exists(filepath):
-                os.remove(filepath)
-                logger.info(f"Cleaned up temporary file: {filepath}")
 
     @app.route(
         "/api/balance_sheets/<int:company_id>/<int:year>", methods=["DELETE"]
     )
-    @jwt_required()
+    @user_required
     def delete_balance_sheet(company_id, year):
-        user_id = int(get_jwt_identity())
-        current_user = User.query.get(user_id)
-
-        if not current_user:
-            return jsonify({"msg": "User not found"}), 404
+        current_user = g.current_user
 
-        if current_user.role not in [ROLE_ADMIN, ROLE_CEO]:
+        if current_user.role not in BALANCE_SHEET_DELETE_ROLES:
             return (
                 jsonify(
                     {
@@ -742,10 +1053,10 @@ def create_app():
             )
 
         if current_user.role == ROLE_CEO:
-            authorized_company_ids = get_authorized_company_ids(current_user)
+            authorized_company_ids = current_authorized_company_ids()
             if company_id not in authorized_company_ids:
                 logger.warning(
-                    f"CEO user {current_user.username} (ID: {user_id}) attempted to delete balance sheet for unauthorized company ID: {company_id}"
+                    f"CEO user {current_user.username} (ID: {current_user.id}) attempted to delete balance sheet for unauthorized company ID: {company_id}"
                 )
                 return (
                     jsonify(
@@ -763,7 +1074,7 @@ def create_app():
             return jsonify({"msg": "Balance sheet not found"}), 404
 
         try:
-            delete_vectors_for_balance_sheet(company_id, year)
+            delete_vectors_for_balance_sheet(company_id, [year])
             logger.info(
                 f"Deleted vector embeddings for Company ID: {company_id}"
             )
@@ -779,18 +1090,14 @@ def create_app():
             )
 
     @app.route("/api/company_metrics/<int:company_id>", methods=["GET"])
-    @jwt_required()
+    @user_required
     def get_company_metrics(company_id):
-        user_id = int(get_jwt_identity())
-        current_user = User.query.get(user_id)
-
-        if not current_user:
-            return jsonify({"msg": "User not found"}), 404
+        current_user = g.current_user
 
-        authorized_company_ids = get_authorized_company_ids(current_user)
+        authorized_company_ids = current_authorized_company_ids()
         if company_id not in authorized_company_ids:
             logger.warning(
-                f"User {current_user.username} (ID: {user_id}) attempted to access metrics for unauthorized company ID: {company_id}"
+                f"User {current_user.username} (ID: {current_user.id}) attempted to access metrics for unauthorized company ID: {company_id}"
             )
             return (
                 jsonify(
@@ -801,15 +1108,20 @@ def create_app():
                 403,
             )
 
-        company = Company.query.get(company_id)
+        company = db.session.execute(
+            select(Company.name, Company.currency).where(
+                Company.id == company_id
+            )
+        ).first()
         if not company:
             return jsonify({"msg": "Company not found"}), 404
 
-        balance_sheets = (
-            BalanceSheet.query.filter_by(company_id=company_id)
+        # Plain column tuples; no ORM objects are built
+        balance_sheets = db.session.execute(
+            select(*METRIC_COLUMNS)
+            .where(BalanceSheet.company_id == company_id)
             .order_by(BalanceSheet.year.desc())
-            .all()
-        )
+        ).all()
 
         if not balance_sheets:
             return (
@@ -819,43 +1131,77 @@ def create_app():
                 404,
             )
 
-        years = []
-        revenue = []
-        net_income = []
-        assets = []
-        liabilities = []
+        return cacheable_json(
+            _metrics_payload(company.name, company.currency, balance_sheets)
+        )
 
-        for bs in balance_sheets:
-            years.append(bs.year)
-            revenue.append(bs.revenue)
-            net_income.append(bs.net_income)
-            assets.append(bs.assets)
-            liabilities.append(bs.liabilities)
+    @app.route("/api/company_metrics/batch", methods=["GET"])
+    @user_required
+    def get_company_metrics_batch():
+        """
+        Returns metrics for several companies (?ids=1,2,3) keyed by company
+        ID. All companies are fetched with one query and all balance sheets
+        with a second, so a dashboard needs two round trips instead of N.
+        Companies without balance sheets are left out of the result.
+        """
+        current_user = g.current_user
 
-        return (
-            jsonify(
-                {
-                    "company_name": company.name,
-                    "currency": company.currency,
-                    "years": years,
-                    "revenue": revenue,
-                    "netIncome": net_income,
-                    "assets": assets,
-                    "liabilities": liabilities,
-                }
-            ),
-            200,
+        try:
+            company_ids = {
+                int(cid) for cid in request.args.get("ids", "").split(",")
+            }
+        except ValueError:
+            return (
+                jsonify({"msg": "ids must be a comma-separated list of IDs"}),
+                400,
+            )
+
+        unauthorized_ids = company_ids - set(current_authorized_company_ids())
+        if unauthorized_ids:
+            logger.warning(
+                f"User {current_user.username} (ID: {current_user.id}) attempted to access metrics for unauthorized company IDs: {sorted(unauthorized_ids)}"
+            )
+            return (
+                jsonify(
+                    {
+                        "msg": "Forbidden: Not authorized to view metrics for this company"
+                    }
+                ),
+                403,
+            )
+
+        companies = db.session.execute(
+            select(Company.id, Company.name, Company.currency).where(
+                Company.id.in_(company_ids)
+            )
+        ).all()
+        balance_sheets = db.session.execute(
+            select(BalanceSheet.company_id, *METRIC_COLUMNS)
+            .where(BalanceSheet.company_id.in_(company_ids))
+            .order_by(BalanceSheet.company_id, BalanceSheet.year.desc())
+        ).all()
+
+        sheets_by_company = {}
+        for company_id, *metrics in balance_sheets:
+            sheets_by_company.setdefault(company_id, []).append(metrics)
+
+        return cacheable_json(
+            {
+                str(company.id): _metrics_payload(
+                    company.name,
+                    company.currency,
+                    sheets_by_company[company.id],
+                )
+                for company in companies
+                if company.id in sheets_by_company
+            }
         )
 
     # --- Chat Interface Route ---
     @app.route("/api/chat", methods=["POST"])
-    @jwt_required()
+    @user_required
     def chat_with_ai():
-        user_id = int(get_jwt_identity())
-        current_user = User.query.get(user_id)
-
-        if not current_user:
-            return jsonify({"msg": "User not found"}), 404
+        current_user = g.current_user
 
         data = request.json
         user_query = data.get("query")
@@ -864,7 +1210,24 @@ def create_app():
         if not user_query or company_id is None:
             return jsonify({"error": "Query and company_id are required"}), 400
 
-        if g.llm is None or g.embeddings is None:
+        try:
+            company_id = int(company_id)
+        except (TypeError, ValueError):
+            return jsonify({"error": "Company ID must be an integer"}), 400
+        if company_id not in current_authorized_company_ids():
+            logger.warning(
+                f"User {current_user.username} (ID: {current_user.id}) attempted to chat about unauthorized company ID: {company_id}"
+            )
+            return (
+                jsonify(
+                    {
+                        "error": "Forbidden: Not authorized to access this company's data"
+                    }
+                ),
+                403,
+            )
+
+        if llm is None or embeddings is None:
             return (
                 jsonify(
                     {
@@ -878,10 +1241,11 @@ def create_app():
             response_text = generate_chat_response(
                 user_query,
                 company_id,
-                g.llm,
-                g.embeddings,
+                llm,
+                embeddings,
                 db.session,
                 None,  # models parameter is no longer directly used in ai_model, can remove later if not needed
+                user_id=current_user.id,
             )
             return jsonify({"response": response_text})
         except Exception as e:
@@ -896,21 +1260,118 @@ def create_app():
                 500,
             )
 
+    @app.route("/api/chat/stream", methods=["POST"])
+    @user_required
+    def stream_chat_with_ai():
+        """
+        Streams the chat answer as newline-delimited JSON, one
+        {"token": ...} object per chunk, so the client can render the reply
+        while Gemini is still generating it.
+        """
+        current_user = g.current_user
+
+        data = request.json
+        user_query = data.get("query")
+        company_id = data.get("company_id")
+
+        if not user_query or company_id is None:
+            return jsonify({"error": "Query and company_id are required"}), 400
+
+        try:
+            company_id = int(company_id)
+        except (TypeError, ValueError):
+            return jsonify({"error": "Company ID must be an integer"}), 400
+        if company_id not in current_authorized_company_ids():
+            logger.warning(
+                f"User {current_user.username} (ID: {current_user.id}) attempted to chat about unauthorized company ID: {company_id}"
+            )
+            return (
+                jsonify(
+                    {
+                        "error": "Forbidden: Not authorized to access this company's data"
+                    }
+                ),
+                403,
+            )
+
+        if llm is None or embeddings is None:
+            return (
+                jsonify(
+                    {
+                        "error": "AI components not initialized. Please try again later."
+                    }
+                ),
+                500,
+            )
+
+        def generate():
+            for chunk in stream_chat_response(
+                user_query,
+                company_id,
+                llm,
+                embeddings,
+                user_id=current_user.id,
+            ):
+                if chunk:
+                    yield orjson.dumps({"token": chunk}) + b"\n"
+
+        return Response(
+            stream_with_context(generate()),
+            mimetype="application/x-ndjson",
+        )
+
+    @app.route("/api/_profile", methods=["GET"])
+    @require_role([ROLE_ADMIN])
+    def list_profiles():
+        """Lists the 50 most recent profile files, newest first."""
+        profile_dir = app.config["PROFILE_DIR"]
+        if not os.path.isdir(profile_dir):
+            return jsonify({"enabled": False, "profiles": []}), 200
+
+        entries = sorted(
+            (
+                entry
+                for entry in os.scandir(profile_dir)
+                if entry.name.endswith(".prof")
+            ),
+            key=lambda entry: entry.stat().st_mtime,
+            reverse=True,
+        )[:50]
+        return (
+            jsonify(
+                {
+                    "enabled": bool(os.environ.get("OCULIS_PROFILE")),
+                    "profiles": [
+                        {"name": entry.name, "size": entry.stat().st_size}
+                        for entry in entries
+                    ],
+                }
+            ),
+            200,
+        )
+
     # --- Health endpoint ---
     @app.get("/api/health")
     def health():
         ai_status = "available" if (llm and embeddings) else "unavailable"
         chroma_status = (
-            "available" if os.path.exists("./chroma_db") else "not_initialized"
+            "available"
+            if app.extensions.get("chroma_client") is not None
+            else "not_initialized"
         )
         # Check if DB has at least one user to confirm connection/tables
-        db_connected = False
-        try:
-            with app.app_context():
-                db_connected = db.session.query(User).first() is not None
-        except Exception as e:
-            logger.error(f"Database health check failed: {e}")
-            db_connected = False
+        with _health_db_lock:
+            db_connected = _health_db_cache.get("db_connected")
+            if db_connected is None:
+                try:
+                    db_connected = (
+                        db.session.execute(select(User.id).limit(1)).first()
+                        is not None
+                    )
+                except Exception as e:
+                    logger.error(f"Database health check failed: {e}")
+                    db_connected = False
+                _health_db_cache["db_connected"] = db_connected
 
         return jsonify(
             {
@@ -931,7 +1392,4 @@ def create_app():
 # For CLI commands, 'create_app' is the preferred way.
 if __name__ == "__main__":
     app = create_app()  # Create the app instance using the factory
-    with app.app_context():
-        db.create_all()
-
     app.run(host="0.0.0.0", port=5000)
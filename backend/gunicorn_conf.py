@@ -0,0 +1,23 @@
+# backend/gunicorn_conf.py
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# The LangChain/Gemini endpoints spend most of their time waiting on the
+# network, so gevent greenlets give far more concurrency than threads.
+worker_class = "gevent"
+worker_connections = 1000
+
+# Chat memory and the query cache live in process memory, and every worker
+# opens its own Chroma index, so one worker is the safe default. Set
+# WEB_CONCURRENCY (e.g. to 2 * cores + 1) once that state is shared.
+workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+
+# LLM calls can take a while; don't let the arbiter kill slow requests
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = "-"
+errorlog = "-"
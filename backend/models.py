@@ -2,35 +2,69 @@
 SQLAlchemy models + helper functions
 """
 
+import sqlite3
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 
 db = SQLAlchemy()
 
+
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    WAL lets readers proceed while a write is in progress; synchronous=NORMAL
+    is durable in WAL mode and skips the fsync on every commit. SQLite only
+    enforces foreign keys (and their ON DELETE actions) when asked to.
+    """
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.close()
+
+
 # Define roles
 ROLE_ADMIN = "group_admin"
 ROLE_CEO = "ceo"
 ROLE_ANALYST = "analyst"
-ALL_ROLES = {ROLE_ANALYST, ROLE_CEO, ROLE_ADMIN}
+ALL_ROLES = frozenset({ROLE_ANALYST, ROLE_CEO, ROLE_ADMIN})
 
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128), nullable=False)
+    password_hash = db.Column(db.String(255), nullable=False)
     role = db.Column(db.String(50), nullable=False, default=ROLE_ANALYST)
     company_id = db.Column(
-        db.Integer, db.ForeignKey("company.id"), nullable=True
+        db.Integer,
+        db.ForeignKey("company.id", ondelete="SET NULL"),
+        nullable=True,
+        index=True,
     )
     email = db.Column(db.String(120), unique=True, nullable=True)
 
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(
+        db.DateTime, default=datetime.utcnow, server_default=db.func.now()
+    )
     updated_at = db.Column(
-        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+        db.DateTime,
+        default=datetime.utcnow,
+        server_default=db.func.now(),
+        onupdate=db.func.now(),
     )
 
-    company = db.relationship("Company", backref="users")
+    # Relationships are lazy="raise": load them explicitly (selectinload etc.)
+    # so an accidental per-row lazy load fails loudly instead of going N+1
+    company = db.relationship(
+        "Company", backref=db.backref("users", lazy="raise"), lazy="raise"
+    )
 
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
@@ -60,15 +94,28 @@ class Company(db.Model):
     name = db.Column(db.String(120), unique=True, nullable=False)
     currency = db.Column(db.String(10), nullable=False, default="USD")
     parent_company_id = db.Column(
-        db.Integer, db.ForeignKey("company.id"), nullable=True
+        db.Integer,
+        db.ForeignKey("company.id", ondelete="SET NULL"),
+        nullable=True,
+        index=True,
     )
 
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(
+        db.DateTime, default=datetime.utcnow, server_default=db.func.now()
+    )
     updated_at = db.Column(
-        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+        db.DateTime,
+        default=datetime.utcnow,
+        server_default=db.func.now(),
+        onupdate=db.func.now(),
     )
 
-    parent = db.relationship("Company", remote_side=[id], backref="children")
+    parent = db.relationship(
+        "Company",
+        remote_side=[id],
+        backref=db.backref("children", lazy="raise"),
+        lazy="raise",
+    )
 
     def to_dict(self):
         return {
@@ -86,7 +133,9 @@ class Company(db.Model):
 class BalanceSheet(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     company_id = db.Column(
-        db.Integer, db.ForeignKey("company.id"), nullable=False
+        db.Integer,
+        db.ForeignKey("company.id", ondelete="CASCADE"),
+        nullable=False,
     )
     year = db.Column(db.Integer, nullable=False)
 
@@ -94,14 +143,25 @@ class BalanceSheet(db.Model):
     net_income = db.Column(db.Float, nullable=True)
     assets = db.Column(db.Float, nullable=True)
     liabilities = db.Column(db.Float, nullable=True)
-    pdf_text = db.Column(db.Text, nullable=True)
+    # Potentially large and never needed to list or delete sheets, so it is
+    # left out of ORM loads; use undefer(BalanceSheet.pdf_text) to fetch it
+    pdf_text = db.deferred(db.Column(db.Text, nullable=True), raiseload=True)
 
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(
+        db.DateTime, default=datetime.utcnow, server_default=db.func.now()
+    )
     updated_at = db.Column(
-        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+        db.DateTime,
+        default=datetime.utcnow,
+        server_default=db.func.now(),
+        onupdate=db.func.now(),
     )
 
-    company = db.relationship("Company", backref="balance_sheets")
+    company = db.relationship(
+        "Company",
+        backref=db.backref("balance_sheets", lazy="raise"),
+        lazy="raise",
+    )
 
     __table_args__ = (
         db.UniqueConstraint("company_id", "year", name="_company_year_uc"),
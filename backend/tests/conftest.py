@@ -0,0 +1,146 @@
+"""
+Shared fixtures: an app on a throwaway SQLite file, tokens for seeded users,
+and a counter for the SQL statements a request sends.
+
+Run from backend/ (see pytest.ini):
+    pip install -r requirements-dev.txt
+    python -m pytest
+"""
+
+from contextlib import contextmanager
+
+import chromadb
+import pytest
+from sqlalchemy import event
+
+import ai_model
+import app as app_module
+from models import (
+    db,
+    User,
+    Company,
+    BalanceSheet,
+    ROLE_ADMIN,
+    ROLE_CEO,
+)
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setenv(
+        "SQLALCHEMY_DATABASE_URI", f"sqlite:///{tmp_path / 'test.sqlite'}"
+    )
+    # Gemini and Chroma stay uninitialized; see the vector_store fixture
+    monkeypatch.setattr(
+        app_module, "initialize_ai_components", lambda: (None, None, None)
+    )
+    app_module.clear_authorized_company_ids_cache()
+
+    flask_app = app_module.create_app()
+    flask_app.config["TESTING"] = True
+    with flask_app.app_context():
+        parent = Company(name="Parent Co", currency="INR")
+        db.session.add(parent)
+        db.session.flush()
+        child = Company(
+            name="Child Co", currency="INR", parent_company_id=parent.id
+        )
+        db.session.add(child)
+        db.session.flush()
+        db.session.add_all(
+            [
+                BalanceSheet(
+                    company_id=company.id,
+                    year=year,
+                    revenue=100.0,
+                    net_income=10.0,
+                    assets=500.0,
+                    liabilities=200.0,
+                )
+                for company in (parent, child)
+                for year in (2022, 2023, 2024)
+            ]
+        )
+        db.session.add_all(
+            [
+                User(username="admin", password_hash="x", role=ROLE_ADMIN),
+                User(
+                    username="ceo",
+                    password_hash="x",
+                    role=ROLE_CEO,
+                    company_id=parent.id,
+                ),
+            ]
+        )
+        db.session.commit()
+    yield flask_app
+    app_module.clear_authorized_company_ids_cache()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def auth_headers(app):
+    """Returns the Authorization header for the seeded user `username`."""
+
+    def headers(username):
+        with app.app_context():
+            user = User.query.filter_by(username=username).one()
+            token = app_module.create_user_access_token(user)
+        return {"Authorization": f"Bearer {token}"}
+
+    return headers
+
+
+class FakeEmbeddings:
+    """Deterministic stand-in for the Gemini embeddings client."""
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        return [float(len(text)), 1.0, 0.0]
+
+
+@pytest.fixture
+def vector_store(tmp_path, monkeypatch):
+    """
+    Points uploads and retrieval at a Chroma store in tmp_path, with fake
+    embeddings. Returns the Chroma client.
+    """
+    client = chromadb.PersistentClient(path=str(tmp_path / "chroma"))
+    monkeypatch.setattr(ai_model, "_chroma_client", client)
+    ai_model._company_vectorstores.clear()
+    monkeypatch.setattr(app_module, "embeddings", FakeEmbeddings())
+    yield client
+    ai_model._company_vectorstores.clear()
+
+
+@contextmanager
+def count_queries(engine):
+    """Collects every SQL statement sent through `engine` inside the block."""
+    statements = []
+
+    def before_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany
+    ):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+@pytest.fixture
+def query_counter(app):
+    def counter():
+        with app.app_context():
+            engine = db.engine
+        return count_queries(engine)
+
+    return counter
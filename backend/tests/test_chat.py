@@ -0,0 +1,35 @@
+"""
+Chat routes: users may only ask about companies they are authorized for.
+"""
+
+import pytest
+
+from models import db, Company
+
+
+@pytest.mark.parametrize("path", ["/api/chat", "/api/chat/stream"])
+def test_chat_about_unauthorized_company_is_403(
+    app, client, auth_headers, path
+):
+    with app.app_context():
+        outsider = Company(name="Outside Co", currency="USD")
+        db.session.add(outsider)
+        db.session.commit()
+        outsider_id = outsider.id
+
+    response = client.post(
+        path,
+        headers=auth_headers("ceo"),
+        json={"query": "What was revenue?", "company_id": outsider_id},
+    )
+    assert response.status_code == 403
+
+
+@pytest.mark.parametrize("path", ["/api/chat", "/api/chat/stream"])
+def test_chat_with_non_integer_company_is_400(client, auth_headers, path):
+    response = client.post(
+        path,
+        headers=auth_headers("ceo"),
+        json={"query": "What was revenue?", "company_id": "abc"},
+    )
+    assert response.status_code == 400
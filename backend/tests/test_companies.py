@@ -0,0 +1,27 @@
+"""
+Company management routes.
+"""
+
+from models import db, Company
+
+
+def test_update_company_with_unknown_parent_is_404(app, client, auth_headers):
+    response = client.put(
+        "/api/companies/1",
+        headers=auth_headers("admin"),
+        json={"name": "Renamed Co", "parent_company_id": 999},
+    )
+    assert response.status_code == 404
+    assert response.get_json() == {"msg": "Parent company not found"}
+    with app.app_context():
+        company = db.session.get(Company, 1)
+        assert (company.name, company.parent_company_id) == ("Parent Co", None)
+
+
+def test_update_company_cannot_be_its_own_parent(client, auth_headers):
+    response = client.put(
+        "/api/companies/1",
+        headers=auth_headers("admin"),
+        json={"parent_company_id": 1},
+    )
+    assert response.status_code == 400
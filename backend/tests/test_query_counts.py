@@ -0,0 +1,31 @@
+"""
+Query-count guards: hot list endpoints must not grow a query per row.
+"""
+
+import pytest
+
+
+@pytest.mark.parametrize("username", ["admin", "ceo"])
+def test_companies_query_count(client, auth_headers, query_counter, username):
+    headers = auth_headers(username)
+    with query_counter() as statements:
+        response = client.get("/api/companies", headers=headers)
+    assert response.status_code == 200
+    assert len(response.get_json()) == 2
+    # Authorized company IDs, then the companies themselves
+    assert len(statements) <= 2, statements
+
+
+def test_company_metrics_batch_query_count(
+    client, auth_headers, query_counter
+):
+    headers = auth_headers("admin")
+    with query_counter() as statements:
+        response = client.get(
+            "/api/company_metrics/batch?ids=1,2", headers=headers
+        )
+    assert response.status_code == 200
+    assert set(response.get_json()) == {"1", "2"}
+    # Authorized company IDs, companies, balance sheets: independent of how
+    # many companies or years are requested
+    assert len(statements) <= 3, statements
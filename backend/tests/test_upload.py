@@ -0,0 +1,112 @@
+"""
+Balance sheet uploads: parsing quirks and keeping existing data on failure.
+"""
+
+import io
+
+import openpyxl
+from openpyxl.styles import Font
+
+import ai_model
+from models import db, BalanceSheet
+
+
+def upload(client, headers, filename, content, company_id=1):
+    return client.post(
+        "/api/balance_sheets",
+        headers=headers,
+        data={
+            "file": (io.BytesIO(content), filename),
+            "company_id": str(company_id),
+        },
+        content_type="multipart/form-data",
+    )
+
+
+def revenues(app, company_id=1):
+    with app.app_context():
+        return dict(
+            db.session.execute(
+                db.select(BalanceSheet.year, BalanceSheet.revenue).where(
+                    BalanceSheet.company_id == company_id
+                )
+            ).all()
+        )
+
+
+def test_upload_csv_with_blank_and_duplicate_metric_rows(
+    app, client, auth_headers, vector_store
+):
+    content = (
+        b"Metric,2023,2024\n"
+        b"Revenue,150,180\n"
+        b"Net Income,15,18\n"
+        b",,\n"
+        b",,\n"
+        b"Notes,audited,unaudited\n"
+        b"Notes,see annex,see annex\n"
+        b"Total Assets,500,550\n"
+        b"Total Liabilities,200,210\n"
+    )
+    response = upload(client, auth_headers("admin"), "sheet.csv", content)
+    assert response.status_code == 201, response.get_json()
+    assert response.get_json()["processed_years"]["2024"] == {
+        "revenue": 180.0,
+        "net_income": 18.0,
+        "assets": 550.0,
+        "liabilities": 210.0,
+    }
+    assert revenues(app) == {2022: 100.0, 2023: 150.0, 2024: 180.0}
+    assert vector_store.get_collection("company_1").count() == 8
+
+
+def test_failed_upload_keeps_existing_data(
+    app, client, auth_headers, vector_store
+):
+    response = upload(
+        client, auth_headers("admin"), "sheet.csv", b"Name,2023\nRevenue,1\n"
+    )
+    assert response.status_code == 422
+    assert revenues(app) == {2022: 100.0, 2023: 100.0, 2024: 100.0}
+
+
+def workbook_with_trailing_empty_rows():
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(["Metric", 2023, 2024])
+    sheet.append(["Revenue", 150, 180])
+    sheet.append(["Net Income", 15, 18])
+    sheet.append(["Total Assets", 500, 550])
+    sheet.append(["Total Liabilities", 200, 210])
+    # Formatted but empty cells: read-only openpyxl yields these rows as None
+    for row in range(6, 10):
+        for column in range(1, 5):
+            sheet.cell(row=row, column=column).font = Font(bold=True)
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def test_read_xlsx_skips_trailing_empty_rows():
+    df = ai_model._read_xlsx(io.BytesIO(workbook_with_trailing_empty_rows()))
+    assert list(df.columns) == ["Metric", 2023, 2024]
+    assert list(df["Metric"]) == [
+        "Revenue",
+        "Net Income",
+        "Total Assets",
+        "Total Liabilities",
+    ]
+
+
+def test_upload_xlsx_with_trailing_empty_rows(
+    app, client, auth_headers, vector_store
+):
+    response = upload(
+        client,
+        auth_headers("admin"),
+        "sheet.xlsx",
+        workbook_with_trailing_empty_rows(),
+    )
+    assert response.status_code == 201, response.get_json()
+    assert revenues(app) == {2022: 100.0, 2023: 150.0, 2024: 180.0}
+    assert vector_store.get_collection("company_1").count() == 8
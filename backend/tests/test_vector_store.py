@@ -0,0 +1,21 @@
+"""
+Per-company Chroma collections: only ingestion may create them.
+"""
+
+import ai_model
+from conftest import FakeEmbeddings
+
+
+def test_retrieval_without_collection_creates_nothing(vector_store):
+    documents = ai_model._retrieve_documents(
+        "What was revenue?", 12345, FakeEmbeddings()
+    )
+    assert documents == []
+    assert vector_store.list_collections() == []
+
+
+def test_deleting_vectors_without_collection_creates_nothing(vector_store):
+    ai_model.delete_vectors_for_balance_sheet(12345, [2023])
+    assert vector_store.list_collections() == []
+    ai_model.delete_vectors_for_balance_sheet(12345)
+    assert vector_store.list_collections() == []
@@ -0,0 +1,16 @@
+# backend/wsgi.py
+# Gunicorn entry point: gunicorn -c gunicorn_conf.py wsgi:app
+
+# Patch the standard library before anything imports sockets or threads
+from gevent import monkey
+
+monkey.patch_all()
+
+# Let the Gemini gRPC client yield to other greenlets while it waits
+import grpc.experimental.gevent as grpc_gevent  # noqa: E402
+
+grpc_gevent.init_gevent()
+
+from app import create_app  # noqa: E402
+
+app = create_app()
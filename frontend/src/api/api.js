@@ -5,9 +5,51 @@ const API_BASE_URL = 'https://oculis-morning-sea-5448.fly.dev/api';
 // Helper function to get the token
 const getToken = () => localStorage.getItem('token');
 
+// Access tokens are short-lived; swap the refresh token for a new one.
+// Returns false if there is no refresh token or it has expired too.
+const refreshAccessToken = async () => {
+    const refreshToken = localStorage.getItem('refresh_token');
+    if (!refreshToken) return false;
+
+    const response = await fetch(`${API_BASE_URL}/refresh`, {
+        method: 'POST',
+        headers: { 'Authorization': `Bearer ${refreshToken}` },
+    });
+    if (!response.ok) return false;
+
+    const data = await response.json();
+    localStorage.setItem('token', data.access_token);
+    return true;
+};
+
+// Sends the request with the current access token, refreshing it and retrying once on a 401
+const fetchWithRefresh = async (url, options, headers) => {
+    const send = () => {
+        const token = getToken();
+        if (token) {
+            headers['Authorization'] = `Bearer ${token}`;
+        }
+        return fetch(url, { ...options, headers });
+    };
+
+    let response = await send();
+    if (response.status === 401 && await refreshAccessToken()) {
+        response = await send();
+    }
+
+    if (response.status === 401) {
+        // If unauthorized, clear tokens and redirect to login
+        localStorage.removeItem('token');
+        localStorage.removeItem('refresh_token');
+        window.location.href = '/login'; // Redirect to login page
+        throw new Error('Unauthorized: Session expired or invalid token.');
+    }
+
+    return response;
+};
+
 // Helper for authenticated fetch requests
 const authenticatedFetch = async (url, options = {}) => {
-    const token = getToken();
     const headers = {
         // 'Content-Type': 'application/json', // This should be set conditionally or not at all for FormData
         ...options.headers,
@@ -19,22 +61,7 @@ const authenticatedFetch = async (url, options = {}) => {
         headers['Content-Type'] = 'application/json';
     }
 
-
-    if (token) {
-        headers['Authorization'] = `Bearer ${token}`;
-    }
-
-    const response = await fetch(url, {
-        ...options,
-        headers,
-    });
-
-    if (response.status === 401) {
-        // If unauthorized, clear token and redirect to login
-        localStorage.removeItem('token');
-        window.location.href = '/login'; // Redirect to login page
-        throw new Error('Unauthorized: Session expired or invalid token.');
-    }
+    const response = await fetchWithRefresh(url, options, headers);
 
     if (!response.ok) {
         const errorData = await response.json().catch(() => ({ message: response.statusText }));
@@ -135,3 +162,33 @@ export const apiChatWithAI = (query, companyId) => authenticatedFetch(`${API_BAS
     method: 'POST',
     body: JSON.stringify({ query, company_id: companyId }),
 });
+
+// Streams the chat answer; onToken is called with each chunk of text as it arrives
+export const apiStreamChatWithAI = async (query, companyId, onToken) => {
+    const response = await fetchWithRefresh(
+        `${API_BASE_URL}/chat/stream`,
+        { method: 'POST', body: JSON.stringify({ query, company_id: companyId }) },
+        { 'Content-Type': 'application/json' },
+    );
+
+    if (!response.ok) {
+        const errorData = await response.json().catch(() => ({ message: response.statusText }));
+        throw new Error(errorData.msg || errorData.error || 'Something went wrong');
+    }
+
+    // The body is newline-delimited JSON: one {"token": "..."} object per line
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    for (;;) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        for (const line of lines) {
+            if (line.trim()) onToken(JSON.parse(line).token);
+        }
+    }
+    if (buffer.trim()) onToken(JSON.parse(buffer).token);
+};
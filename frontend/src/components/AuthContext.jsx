@@ -22,6 +22,7 @@ export const AuthProvider = ({ children }) => {
             } catch (error) {
                 console.error("Token validation failed or user not found:", error);
                 localStorage.removeItem('token'); // Clear invalid token
+                localStorage.removeItem('refresh_token');
                 setUser(null); // This is where setUser is called
             }
         }
@@ -36,6 +37,7 @@ export const AuthProvider = ({ children }) => {
         try {
             const data = await apiLogin(username, password);
             localStorage.setItem('token', data.access_token);
+            localStorage.setItem('refresh_token', data.refresh_token);
             // After successful login, reload user data to update context
             await loadUser(); // This calls loadUser, which then calls setUser
             navigate('/'); // Navigate to dashboard on successful login
@@ -51,12 +53,14 @@ export const AuthProvider = ({ children }) => {
         try {
             await apiLogout(); // Call backend logout (if it does anything, e.g., token blacklisting)
             localStorage.removeItem('token');
+            localStorage.removeItem('refresh_token');
             setUser(null); // This is where setUser is called
             navigate('/login'); // Redirect to login page
         } catch (error) {
             console.error("Logout failed:", error);
             // Even if backend logout fails, clear client-side token
             localStorage.removeItem('token');
+            localStorage.removeItem('refresh_token');
             setUser(null);
             navigate('/login');
         }
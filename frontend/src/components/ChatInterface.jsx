@@ -1,7 +1,7 @@
 // frontend/src/components/ChatInterface.jsx
 
 import React, { useState, useEffect, useRef } from 'react';
-import { apiChatWithAI, apiUploadBalanceSheet } from '../api/api';
+import { apiStreamChatWithAI, apiUploadBalanceSheet } from '../api/api';
 import { FaPaperPlane, FaFileUpload, FaSpinner, FaCheckCircle, FaTimesCircle, FaInfoCircle, FaTrashAlt } from 'react-icons/fa'; // Added FaTrashAlt for clear chat
 
 export default function ChatInterface({ companyId, companyName }) {
@@ -49,9 +49,17 @@ export default function ChatInterface({ companyId, companyName }) {
         setError(null);
 
         try {
-            const response = await apiChatWithAI(input, companyId);
-            const aiMessage = { sender: 'ai', text: response.response };
-            setMessages((prevMessages) => [...prevMessages, aiMessage]);
+            // Add the AI message on the first token and grow it as the rest stream in
+            let started = false;
+            await apiStreamChatWithAI(input, companyId, (token) => {
+                const isFirst = !started;
+                started = true;
+                setMessages((prevMessages) => {
+                    if (isFirst) return [...prevMessages, { sender: 'ai', text: token }];
+                    const last = prevMessages[prevMessages.length - 1];
+                    return [...prevMessages.slice(0, -1), { ...last, text: last.text + token }];
+                });
+            });
         } catch (err) {
             console.error("Error communicating with AI:", err);
             const errorMessage = err.message || "Failed to get response from AI. Please try again.";